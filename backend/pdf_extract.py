@@ -0,0 +1,38 @@
+# PDF text extraction run inside PDF worker processes. Kept free of the web app's
+# imports so spawned workers stay small.
+import resource
+from typing import Tuple
+
+import pypdfium2 as pdfium
+
+
+def limit_worker_memory(limit_mb: int):
+    """Cap the address space of a PDF worker process; 0 disables the cap"""
+    if limit_mb > 0:
+        limit = limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def extract_text_from_pdf(source, max_chars: int) -> Tuple[str, bool]:
+    """Extract up to max_chars of text from a PDF given as bytes or a binary file-like object.
+    Also reports whether any text was left out."""
+    pdf = pdfium.PdfDocument(source)
+    try:
+        # Stop reading pages once the extraction budget is reached
+        page_count = len(pdf)
+        pages = []
+        extracted_chars = 0
+        for index in range(page_count):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            page_text = textpage.get_text_bounded()
+            textpage.close()
+            page.close()
+            pages.append(page_text)
+            extracted_chars += len(page_text) + 1
+            if extracted_chars >= max_chars:
+                break
+        text = "\n".join(pages)
+        return text[:max_chars], len(pages) < page_count or len(text) > max_chars
+    finally:
+        pdf.close()
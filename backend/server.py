@@ -1,20 +1,32 @@
-from fastapi import FastAPI, APIRouter, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, File, UploadFile, HTTPException, BackgroundTasks, Query
+from fastapi.responses import JSONResponse, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
+from bson import Binary
+import zstandard as zstd
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, TypeAdapter
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 import aiofiles
-import json
+import orjson
+import re
+import hashlib
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from cachetools import TTLCache
 from emergentintegrations.llm.chat import LlmChat, UserMessage
-import PyPDF2
-import io
+from pdf_extract import extract_text_from_pdf, limit_worker_memory
+import codecs
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import base64
 from enum import Enum
 
@@ -23,11 +35,69 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    tz_aware=True,
+    maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+    minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', 10)),
+    waitQueueTimeoutMS=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000))
+)
 db = client[os.environ['DB_NAME']]
 
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Allowed CORS origins, parsed once from a comma-separated list
+CORS_ORIGINS = [origin.strip() for origin in os.environ.get('CORS_ORIGINS', '*').split(',') if origin.strip()]
+
+# LLM configuration
+LLM_PROVIDER = "gemini"
+LLM_MODEL = "gemini-2.0-flash"
+# Bump whenever the analysis prompt changes so stale cached responses are not reused
+PROMPT_VERSION = "3"
+CACHE_SCOPE_PREFIX = f"{LLM_MODEL}|{PROMPT_VERSION}|"
+LLM_CACHE_TTL_SECONDS = 60 * 60 * 24 * 7
+# Concurrent LLM calls allowed per process; further requests queue for a slot
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 8))
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+# Stored analyses are deleted after this many days; 0 (the default) keeps them forever
+ANALYSIS_RETENTION_DAYS = int(os.environ.get('ANALYSIS_RETENTION_DAYS', 0))
+INDEX_SYNC_ATTEMPTS = 3
+
+# In-process cache of parsed LLM responses, checked before MongoDB
+ai_analysis_cache = TTLCache(maxsize=1024, ttl=600)
+
+# Analyses are persisted in the background; keep recent ones in memory so they can be
+# fetched before the write lands
+recent_analyses = TTLCache(maxsize=256, ttl=60)
+# Ids deleted before their background write landed; the write must not resurrect them
+deleted_analysis_ids = TTLCache(maxsize=1024, ttl=600)
+PERSIST_ATTEMPTS = 3
+PERSIST_BACKOFF_SECONDS = 0.5
+
+# Stored document text is zstd-compressed; it is only read back for single analyses
+zstd_compressor = zstd.ZstdCompressor(level=9)
+zstd_decompressor = zstd.ZstdDecompressor()
+# Longer texts are compressed in a worker thread rather than on the event loop
+COMPRESS_OFF_LOOP_CHARS = 64 * 1024
+
+# Near-duplicate documents reuse an earlier analysis when their embeddings are this similar.
+# Embeddings cover the whole text sent to the LLM, so contracts built from one template
+# but differing further down do not match.
+SEMANTIC_CACHE_THRESHOLD = 0.97
+EMBEDDING_BITS = 11
+EMBEDDING_SHINGLE_BYTES = 4
+# Atlas Vector Search index on analysis_embeddings.embedding (with cache_scope as a filter
+# field). The near-duplicate cache is disabled unless this is set.
+VECTOR_SEARCH_INDEX = os.environ.get('VECTOR_SEARCH_INDEX')
+
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -38,6 +108,8 @@ class RiskLevel(str, Enum):
     MEDIUM = "medium"
     HIGH = "high"
 
+RISK_LEVEL_MAP = {level.value: level for level in RiskLevel}
+
 # Models
 class ClauseAnalysis(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -57,18 +129,39 @@ class DocumentAnalysis(BaseModel):
     summary: str
     recommendations: List[str]
     overall_risk_score: float
-    created_at: datetime = Field(default_factory=lambda: datetime.now())
+    # PDFs are only extracted up to MAX_EXTRACT_CHARS, so full_document_text may be partial
+    text_truncated: bool = False
+    # Set when the analysis was reused from a near-identical document
+    similar_document_score: Optional[float] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+clause_list_adapter = TypeAdapter(List[ClauseAnalysis])
+
+class DocumentAnalysisSummary(BaseModel):
+    id: str
+    document_id: str
+    filename: str
+    document_type: str
+    summary: str
+    overall_risk_score: float
+    created_at: datetime
+
+# Only the summary fields are read for analysis listings
+ANALYSIS_SUMMARY_PROJECTION = {"_id": 0, **{field: 1 for field in DocumentAnalysisSummary.model_fields}}
+
+class AnalysisPage(BaseModel):
+    items: List[DocumentAnalysisSummary]
+    next_skip: Optional[int] = None
+
+MAX_ANALYSES_PAGE_SIZE = 100
 
 class DocumentAnalysisCreate(BaseModel):
     filename: str
     document_type: str
 
-# Initialize LLM Chat
-def get_llm_chat():
-    return LlmChat(
-        api_key=os.environ.get('EMERGENT_LLM_KEY'),
-        session_id=f"legal_doc_{uuid.uuid4()}",
-        system_message="""You are an expert legal document analyzer. Your job is to:
+# Static instructions and output schema. Kept byte-identical across requests so the
+# provider can reuse its cached prefix; only the document itself goes in the user message.
+ANALYSIS_SYSTEM_MESSAGE = """You are an expert legal document analyzer. Your job is to:
 1. Identify risky clauses in legal documents
 2. Assign risk scores from 1-10 (1=low risk, 10=extremely risky)
 3. Classify each clause as LOW (1-3), MEDIUM (4-6), or HIGH (7-10) risk
@@ -84,165 +177,531 @@ Focus on common risk factors like:
 - Exclusive dealing arrangements
 - Dispute resolution limitations
 - Intellectual property transfers
-- Data usage and privacy terms"""
-    ).with_model("gemini", "gemini-2.0-flash")
+- Data usage and privacy terms
+
+Analyze each legal document you are given and provide a detailed risk assessment in the
+following JSON format:
+{
+    "clauses": [
+        {
+            "clause_text": "actual clause text",
+            "risk_level": "low|medium|high",
+            "risk_score": 1-10,
+            "explanation": "why this clause is risky in plain English",
+            "section": "section name if identifiable"
+        }
+    ],
+    "summary": "plain language summary of the entire document",
+    "recommendations": ["actionable recommendation 1", "actionable recommendation 2"],
+    "document_type": "contract|terms_of_service|privacy_policy|loan_agreement|other"
+}
+
+Focus on identifying the most important risky clauses. Limit to maximum 10 clauses per document.
+
+A user message usually contains one document; respond with one JSON object as above. When it
+contains several documents, follow the response format given in that message instead."""
+
+# Characters of document text sent to the LLM
+MAX_PROMPT_CHARS = 10000
+# Characters extracted from a PDF before the remaining pages are skipped; kept
+# above MAX_PROMPT_CHARS so the prompt slice does not depend on page boundaries
+MAX_EXTRACT_CHARS = max(int(os.environ.get('MAX_EXTRACT_CHARS', 12000)), MAX_PROMPT_CHARS)
+
+# Markdown code fence the LLM sometimes wraps its JSON response in
+JSON_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+# Cheap checks that let obviously unsuitable documents skip the LLM
+MIN_DOCUMENT_CHARS = 200
+MIN_LEGAL_HINT_WORDS = 2
+LEGAL_HINT_WORDS = frozenset({
+    "agreement", "clause", "party", "parties", "hereby", "shall", "liability",
+    "terminat", "indemn", "warrant", "jurisdiction", "governing law", "obligation",
+    "breach", "confidential", "privacy", "terms", "contract", "license", "arbitration"
+})
+NON_LEGAL_SUMMARY = "Document does not appear to be a legal document."
+
+# Several documents can be analyzed in one LLM call; each gets a shorter slice
+MAX_BATCH_DOCUMENTS = 10
+MAX_BATCH_PROMPT_CHARS = 5000
+BATCH_ANALYSIS_INSTRUCTIONS = """This message contains several separate legal documents, each starting with a
+===DOC n=== marker. Analyze every document independently using the per-document JSON format
+from your instructions, and respond with a single JSON object of the form:
+{
+    "results": [
+        {"doc_index": n, "clauses": [...], "summary": "...", "recommendations": [...], "document_type": "..."}
+    ]
+}
+Include exactly one result per document."""
+BATCH_PROMPT_PREFIX = BATCH_ANALYSIS_INSTRUCTIONS + "\n\n"
+
+# Uploads are read in chunks of this size rather than buffered whole
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# PDF parsing runs in worker processes: PDFium is not thread-safe, and separate
+# processes let concurrent uploads parse in parallel without holding the GIL.
+# With 0 workers PDFs are parsed in-process on one thread, straight from the upload.
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', min(4, os.cpu_count() or 1)))
+# Address-space cap for each PDF worker; 0 disables it
+PDF_WORKER_MEMORY_MB = int(os.environ.get('PDF_WORKER_MEMORY_MB', 1024))
+# Parses of one PDF, counting the resubmission after a crashed worker broke the pool
+PDF_PARSE_ATTEMPTS = 2
+
+# Initialize LLM Chat. Each request gets its own chat so no conversation history is
+# shared between documents.
+def get_llm_chat():
+    return LlmChat(
+        api_key=os.environ.get('EMERGENT_LLM_KEY'),
+        session_id=f"legal_doc_{uuid.uuid4()}",
+        system_message=ANALYSIS_SYSTEM_MESSAGE
+    ).with_model(LLM_PROVIDER, LLM_MODEL)
+
+async def send_llm_message(text: str) -> str:
+    """Send one prompt on a fresh chat, waiting while LLM_MAX_CONCURRENCY calls are in flight"""
+    async with llm_semaphore:
+        chat = get_llm_chat()
+        return await chat.send_message(UserMessage(text=text))
+
+def create_pdf_pool() -> Executor:
+    if PDF_WORKERS <= 0:
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdfium")
+    # Spawn rather than fork so workers do not inherit the event loop or Mongo sockets;
+    # the submitted functions live in pdf_extract so workers never import this module
+    return ProcessPoolExecutor(
+        max_workers=PDF_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=limit_worker_memory,
+        initargs=(PDF_WORKER_MEMORY_MB,)
+    )
+
+pdf_pool = create_pdf_pool()
+
+async def read_pdf_upload(file: UploadFile) -> Tuple[str, bool]:
+    """Extract the text of an uploaded PDF off the event loop, and whether it was cut short"""
+    global pdf_pool
+    await file.seek(0)
+    if isinstance(pdf_pool, ProcessPoolExecutor):
+        # The whole file has to cross the process boundary; a truncated PDF loses its xref table
+        source = await file.read()
+    else:
+        # In-process parsing reads the spooled upload directly, without a bytes copy
+        source = file.file
+    loop = asyncio.get_running_loop()
+    for attempt in range(1, PDF_PARSE_ATTEMPTS + 1):
+        pool = pdf_pool
+        try:
+            return await loop.run_in_executor(pool, extract_text_from_pdf, source, MAX_EXTRACT_CHARS)
+        except BrokenProcessPool:
+            # A worker died (e.g. hit its memory cap), failing every PDF the pool was parsing.
+            # Replace the pool and resubmit, so only the PDF that keeps crashing gets an error.
+            if pdf_pool is pool:
+                pdf_pool = create_pdf_pool()
+                pool.shutdown(wait=False)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
+    raise HTTPException(status_code=400, detail="Error reading PDF: the document could not be parsed")
+
+def normalize_document_text(text: str) -> str:
+    """Collapse whitespace and case so trivially different uploads share a cache entry"""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def get_cache_scope(filename: str) -> str:
+    """Cached responses are only shared between documents with the same scope"""
+    return CACHE_SCOPE_PREFIX + Path(filename).suffix.lower()
+
+def get_analysis_cache_key(text: str, filename: str) -> str:
+    """Build the LLM response cache key for a document"""
+    key_source = f"{get_cache_scope(filename)}|{normalize_document_text(text)}"
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+def embed_document_text(text: str) -> List[float]:
+    """Embed the text sent to the LLM as a normalized hashed byte-shingle vector"""
+    data = np.frombuffer(normalize_document_text(text[:MAX_PROMPT_CHARS]).encode('utf-8'), dtype=np.uint8)
+    vector = np.zeros(1 << EMBEDDING_BITS, dtype=np.float32)
+    if len(data) >= EMBEDDING_SHINGLE_BYTES:
+        # Pack each shingle into a uint32 and bucket it by multiplicative hashing
+        windows = sliding_window_view(data, EMBEDDING_SHINGLE_BYTES)
+        codes = np.zeros(len(windows), dtype=np.uint32)
+        for column in range(EMBEDDING_SHINGLE_BYTES):
+            codes = (codes << np.uint32(8)) | windows[:, column]
+        buckets = (codes * np.uint32(2654435761)) >> np.uint32(32 - EMBEDDING_BITS)
+        vector += np.bincount(buckets, minlength=len(vector))
+        vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+async def get_cached_ai_analysis(cache_key: str) -> Optional[Dict[str, Any]]:
+    """Look up a previously parsed LLM response"""
+    try:
+        cached = await db.llm_response_cache.find_one({"_id": cache_key})
+    except Exception as e:
+        logger.warning(f"LLM response cache lookup failed: {str(e)}")
+        return None
+    return cached["analysis_json"] if cached else None
+
+async def store_cached_ai_analysis(cache_key: str, ai_analysis: Dict[str, Any]):
+    """Store a parsed LLM response for reuse by identical documents"""
+    try:
+        await db.llm_response_cache.replace_one(
+            {"_id": cache_key},
+            {"_id": cache_key, "analysis_json": ai_analysis, "created_at": datetime.now(timezone.utc)},
+            upsert=True
+        )
+    except Exception as e:
+        logger.warning(f"LLM response cache write failed: {str(e)}")
+
+async def find_similar_ai_analysis(embedding: List[float], cache_scope: str) -> Optional[Tuple[Dict[str, Any], float]]:
+    """Find the cached LLM response and similarity of the most similar previously analyzed document"""
+    try:
+        matches = await db.analysis_embeddings.aggregate([
+            {"$vectorSearch": {
+                "index": VECTOR_SEARCH_INDEX,
+                "path": "embedding",
+                "queryVector": embedding,
+                "numCandidates": 50,
+                "limit": 1,
+                "filter": {"cache_scope": cache_scope}
+            }},
+            {"$project": {"score": {"$meta": "vectorSearchScore"}}}
+        ]).to_list(1)
+    except Exception as e:
+        logger.warning(f"Semantic cache lookup failed: {str(e)}")
+        return None
+    if not matches:
+        return None
+    
+    # Atlas reports cosine similarity rescaled to (1 + cosine) / 2
+    similarity = 2 * matches[0]["score"] - 1
+    if similarity < SEMANTIC_CACHE_THRESHOLD:
+        return None
+    cached_analysis = await get_cached_ai_analysis(matches[0]["_id"])
+    if cached_analysis is None:
+        return None
+    logger.info(f"Semantic cache hit on {matches[0]['_id']} with similarity {similarity:.4f}")
+    return cached_analysis, similarity
+
+async def store_document_embedding(cache_key: str, cache_scope: str, embedding: List[float]):
+    """Store a document embedding pointing at its cached LLM response"""
+    try:
+        await db.analysis_embeddings.replace_one(
+            {"_id": cache_key},
+            {
+                "_id": cache_key,
+                "cache_scope": cache_scope,
+                "embedding": embedding,
+                "created_at": datetime.now(timezone.utc)
+            },
+            upsert=True
+        )
+    except Exception as e:
+        logger.warning(f"Semantic cache write failed: {str(e)}")
+
+def build_document_analysis(ai_analysis: Dict[str, Any], text: str, filename: str) -> DocumentAnalysis:
+    """Convert a parsed LLM response into a DocumentAnalysis"""
+    # Normalize risk levels so "High" or an unknown level does not fail validation,
+    # then validate every clause in one pass
+    clauses = clause_list_adapter.validate_python([
+        {**clause_data, "risk_level": RISK_LEVEL_MAP.get(str(clause_data.get("risk_level", "")).lower(), RiskLevel.LOW)}
+        for clause_data in ai_analysis.get("clauses", [])
+    ])
+    
+    # Calculate overall risk score
+    scores = [clause.risk_score for clause in clauses]
+    overall_risk = sum(scores) / len(scores) if scores else 0
+    
+    return DocumentAnalysis(
+        document_id=str(uuid.uuid4()),
+        filename=filename,
+        document_type=ai_analysis.get("document_type", "unknown"),
+        full_document_text=text,
+        clauses=clauses,
+        summary=ai_analysis.get("summary", ""),
+        recommendations=ai_analysis.get("recommendations", []),
+        overall_risk_score=round(overall_risk, 2)
+    )
+
+async def read_text_upload(file: UploadFile) -> str:
+    """Decode an uploaded UTF-8 text file chunk by chunk"""
+    await file.seek(0)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parts = []
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        parts.append(decoder.decode(chunk))
+    parts.append(decoder.decode(b'', final=True))
+    return "".join(parts)
 
-def extract_text_from_pdf(file_content: bytes) -> str:
-    """Extract text from PDF file"""
+def compress_document_text(text: str) -> Dict[str, Binary]:
+    """Compress document text for storage"""
+    return {"zstd": Binary(zstd_compressor.compress(text.encode('utf-8')))}
+
+def decompress_document_text(stored: Any) -> Optional[str]:
+    """Restore document text stored by compress_document_text; older rows hold plain text"""
+    if isinstance(stored, dict) and "zstd" in stored:
+        return zstd_decompressor.decompress(stored["zstd"]).decode('utf-8')
+    return stored
+
+async def remove_deleted_analyses(analysis_dicts: List[Dict[str, Any]]):
+    """Delete analyses whose DELETE request arrived while they were being written"""
+    deleted_ids = [d['id'] for d in analysis_dicts if d['id'] in deleted_analysis_ids]
+    if deleted_ids:
+        await db.document_analyses.delete_many({"id": {"$in": deleted_ids}})
+
+async def persist_analyses(analysis_dicts: List[Dict[str, Any]]):
+    """Store analyses in one write, retrying failed writes with exponential backoff"""
+    for analysis_dict in analysis_dicts:
+        text = analysis_dict.get('full_document_text')
+        if not isinstance(text, str):
+            continue
+        if len(text) > COMPRESS_OFF_LOOP_CHARS:
+            # zstd releases the GIL, so a large TXT upload compresses without stalling other requests
+            analysis_dict['full_document_text'] = await asyncio.to_thread(compress_document_text, text)
+        else:
+            analysis_dict['full_document_text'] = compress_document_text(text)
+    
+    for attempt in range(1, PERSIST_ATTEMPTS + 1):
+        analysis_dicts = [d for d in analysis_dicts if d['id'] not in deleted_analysis_ids]
+        if not analysis_dicts:
+            return
+        try:
+            await db.document_analyses.insert_many(analysis_dicts, ordered=False)
+            await remove_deleted_analyses(analysis_dicts)
+            return
+        except BulkWriteError as e:
+            # Duplicates are documents an earlier attempt already stored
+            if all(error.get("code") == 11000 for error in e.details.get("writeErrors", [])):
+                await remove_deleted_analyses(analysis_dicts)
+                return
+            error = e
+        except Exception as e:
+            error = e
+        if attempt == PERSIST_ATTEMPTS:
+            logger.error(f"Failed to store {len(analysis_dicts)} analyses: {str(error)}")
+            return
+        logger.warning(f"Storing {len(analysis_dicts)} analyses failed (attempt {attempt}): {str(error)}")
+        await asyncio.sleep(PERSIST_BACKOFF_SECONDS * 2 ** (attempt - 1))
+
+def looks_like_legal_document(text: str) -> bool:
+    """Check whether the text contains enough legal vocabulary to be worth analyzing"""
+    lowered = text.lower()
+    return sum(1 for word in LEGAL_HINT_WORDS if word in lowered) >= MIN_LEGAL_HINT_WORDS
+
+def build_non_legal_analysis(text: str, filename: str) -> DocumentAnalysis:
+    """Build the canned analysis returned for documents that are not legal documents"""
+    return DocumentAnalysis(
+        document_id=str(uuid.uuid4()),
+        filename=filename,
+        document_type="other",
+        full_document_text=text,
+        clauses=[],
+        summary=NON_LEGAL_SUMMARY,
+        recommendations=[],
+        overall_risk_score=0
+    )
+
+async def find_analysis_without_llm(text: str, filename: str) -> Optional[DocumentAnalysis]:
+    """Answer documents that need no LLM call: non-legal text and previously analyzed documents"""
+    if not looks_like_legal_document(text):
+        return build_non_legal_analysis(text, filename)
+    return await lookup_cached_analysis(text, filename)
+
+async def lookup_cached_analysis(text: str, filename: str) -> Optional[DocumentAnalysis]:
+    """Build an analysis from a cached LLM response for an identical or near-identical document"""
+    cache_key = get_analysis_cache_key(text, filename)
+    similarity = None
+    cached_analysis = ai_analysis_cache.get(cache_key)
+    if cached_analysis is None:
+        cached_analysis = await get_cached_ai_analysis(cache_key)
+    if cached_analysis is None and VECTOR_SEARCH_INDEX:
+        similar = await find_similar_ai_analysis(embed_document_text(text), get_cache_scope(filename))
+        if similar is not None:
+            cached_analysis, similarity = similar
+    if cached_analysis is None:
+        return None
+    
     try:
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        document_analysis = build_document_analysis(cached_analysis, text, filename)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
+        logger.warning(f"Discarding unusable cached analysis: {str(e)}")
+        return None
+    if similarity is None:
+        ai_analysis_cache[cache_key] = cached_analysis
+    else:
+        # Flag analyses that were borrowed from a different, similar document
+        document_analysis.similar_document_score = round(similarity, 4)
+    return document_analysis
+
+async def cache_ai_analysis(text: str, filename: str, ai_analysis: Dict[str, Any]):
+    """Make a parsed LLM response available to later identical or near-identical documents"""
+    cache_key = get_analysis_cache_key(text, filename)
+    ai_analysis_cache[cache_key] = ai_analysis
+    await store_cached_ai_analysis(cache_key, ai_analysis)
+    if VECTOR_SEARCH_INDEX:
+        await store_document_embedding(cache_key, get_cache_scope(filename), embed_document_text(text))
+
+def build_document_prompt(filename: str, text: str, max_chars: int) -> str:
+    """Build the per-document part of a prompt; everything static lives in module constants"""
+    return f"DOCUMENT: {filename}\nCONTENT: {text[:max_chars]}"
+
+def parse_ai_response(response: str) -> Dict[str, Any]:
+    """Parse the JSON object returned by the LLM, with or without a markdown fence"""
+    return orjson.loads(JSON_FENCE_RE.sub("", response.strip()))
 
 async def analyze_document_with_ai(text: str, filename: str) -> DocumentAnalysis:
     """Analyze document text using AI"""
-    chat = get_llm_chat()
+    # Non-legal and identical or near-identical documents skip the LLM round-trip entirely
+    precomputed_analysis = await find_analysis_without_llm(text, filename)
+    if precomputed_analysis is not None:
+        return precomputed_analysis
     
-    # Create analysis prompt
-    analysis_prompt = f"""
-    Analyze this legal document and provide a detailed risk assessment:
-
-    DOCUMENT: {filename}
-    CONTENT: {text[:10000]}...
-
-    Please provide your analysis in the following JSON format:
-    {{
-        "clauses": [
-            {{
-                "clause_text": "actual clause text",
-                "risk_level": "low|medium|high",
-                "risk_score": 1-10,
-                "explanation": "why this clause is risky in plain English",
-                "section": "section name if identifiable"
-            }}
-        ],
-        "summary": "plain language summary of the entire document",
-        "recommendations": ["actionable recommendation 1", "actionable recommendation 2"],
-        "document_type": "contract|terms_of_service|privacy_policy|loan_agreement|other"
-    }}
-
-    Focus on identifying the most important risky clauses. Limit to maximum 10 clauses.
-    """
+    # Only the document varies between requests
+    analysis_prompt = build_document_prompt(filename, text, MAX_PROMPT_CHARS)
     
     try:
-        user_message = UserMessage(text=analysis_prompt)
-        response = await chat.send_message(user_message)
-        
-        # Parse AI response
-        response_text = response.strip()
-        if response_text.startswith("```json"):
-            response_text = response_text[7:-3]
-        elif response_text.startswith("```"):
-            response_text = response_text[3:-3]
-        
-        ai_analysis = json.loads(response_text)
+        response = await send_llm_message(analysis_prompt)
         
-        # Convert to our models
-        clauses = []
-        total_risk = 0
-        
-        for clause_data in ai_analysis.get("clauses", []):
-            clause = ClauseAnalysis(
-                clause_text=clause_data["clause_text"],
-                risk_level=RiskLevel(clause_data["risk_level"]),
-                risk_score=clause_data["risk_score"],
-                explanation=clause_data["explanation"],
-                section=clause_data.get("section")
-            )
-            clauses.append(clause)
-            total_risk += clause.risk_score
+        ai_analysis = parse_ai_response(response)
         
-        # Calculate overall risk score
-        overall_risk = total_risk / len(clauses) if clauses else 0
-        
-        document_analysis = DocumentAnalysis(
-            document_id=str(uuid.uuid4()),
-            filename=filename,
-            document_type=ai_analysis.get("document_type", "unknown"),
-            full_document_text=text,
-            clauses=clauses,
-            summary=ai_analysis.get("summary", ""),
-            recommendations=ai_analysis.get("recommendations", []),
-            overall_risk_score=round(overall_risk, 2)
-        )
+        # Convert to our models before caching so only valid responses are stored
+        document_analysis = build_document_analysis(ai_analysis, text, filename)
+        await cache_ai_analysis(text, filename, ai_analysis)
         
         return document_analysis
         
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         raise HTTPException(status_code=500, detail=f"Error parsing AI response: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error analyzing document: {str(e)}")
 
-# API Routes
-@api_router.get("/")
-async def root():
-    return {"message": "AI Legal Document Assistant API"}
-
-@api_router.post("/analyze-document", response_model=DocumentAnalysis)
-async def analyze_document(file: UploadFile = File(...)):
-    """Analyze uploaded legal document"""
+async def analyze_documents_with_ai(texts: List[str], filenames: List[str]) -> List[DocumentAnalysis]:
+    """Analyze several documents, bundling the uncached ones into a single LLM call"""
+    analyses = list(await asyncio.gather(*[
+        find_analysis_without_llm(text, filename) for text, filename in zip(texts, filenames)
+    ]))
+    pending = [i for i, analysis in enumerate(analyses) if analysis is None]
+    
+    if len(pending) > 1:
+        analysis_prompt = BATCH_PROMPT_PREFIX + "".join(
+            f"===DOC {i}===\n{build_document_prompt(filenames[i], texts[i], MAX_BATCH_PROMPT_CHARS)}\n"
+            for i in pending
+        )
+        try:
+            response = await send_llm_message(analysis_prompt)
+            
+            for result in parse_ai_response(response).get("results", []):
+                try:
+                    i = int(result["doc_index"])
+                    if i in pending and analyses[i] is None:
+                        analyses[i] = build_document_analysis(result, texts[i], filenames[i])
+                except Exception as e:
+                    logger.warning(f"Skipping unusable batch analysis result: {str(e)}")
+        except Exception as e:
+            logger.warning(f"Batch analysis failed, analyzing documents individually: {str(e)}")
+    
+    # Anything the batch response did not cover is analyzed on its own
+    missing = [i for i in pending if analyses[i] is None]
+    results = await asyncio.gather(*[analyze_document_with_ai(texts[i], filenames[i]) for i in missing])
+    for i, analysis in zip(missing, results):
+        analyses[i] = analysis
     
+    return analyses
+
+async def extract_upload_text(file: UploadFile) -> Tuple[str, bool]:
+    """Extract the text of an uploaded PDF or TXT document, and whether it was truncated"""
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file uploaded")
     
-    # Read file content
-    content = await file.read()
-    
-    # Extract text based on file type
+    # Extract text based on file type; only PDFs are cut off at MAX_EXTRACT_CHARS
     if file.filename.lower().endswith('.pdf'):
-        text = extract_text_from_pdf(content)
+        text, truncated = await read_pdf_upload(file)
     elif file.filename.lower().endswith('.txt'):
-        text = content.decode('utf-8')
+        text, truncated = await read_text_upload(file), False
     else:
         raise HTTPException(status_code=400, detail="Unsupported file type. Please upload PDF or TXT files.")
     
     if not text.strip():
         raise HTTPException(status_code=400, detail="No text content found in the document")
     
+    if len(text.strip()) < MIN_DOCUMENT_CHARS:
+        raise HTTPException(status_code=400, detail="Document too short to analyze")
+    
+    return text, truncated
+
+# API Routes
+@api_router.get("/")
+async def root():
+    return {"message": "AI Legal Document Assistant API"}
+
+@api_router.post("/analyze-document", response_model=DocumentAnalysis)
+async def analyze_document(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+    """Analyze uploaded legal document"""
+    
+    text, truncated = await extract_upload_text(file)
+    
     # Analyze with AI
     analysis = await analyze_document_with_ai(text, file.filename)
+    analysis.text_truncated = truncated
     
-    # Store in database
+    # Store in database after the response has been sent
     analysis_dict = analysis.dict()
-    analysis_dict['created_at'] = analysis_dict['created_at'].isoformat()
-    await db.document_analyses.insert_one(analysis_dict)
+    recent_analyses[analysis.id] = analysis
+    background_tasks.add_task(persist_analyses, [analysis_dict])
     
     return analysis
 
-@api_router.get("/analyses", response_model=List[DocumentAnalysis])
-async def get_analyses():
-    """Get all document analyses"""
-    analyses = await db.document_analyses.find().sort("created_at", -1).to_list(100)
+@api_router.post("/analyze-documents", response_model=List[DocumentAnalysis])
+async def analyze_documents(background_tasks: BackgroundTasks, files: List[UploadFile] = File(...)):
+    """Analyze several uploaded legal documents together"""
+    if len(files) > MAX_BATCH_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"Too many files. Upload at most {MAX_BATCH_DOCUMENTS} documents at once.")
     
+    extracted = await asyncio.gather(*[extract_upload_text(file) for file in files])
+    
+    # Analyze with AI
+    analyses = await analyze_documents_with_ai([text for text, _ in extracted], [file.filename for file in files])
+    for analysis, (_, truncated) in zip(analyses, extracted):
+        analysis.text_truncated = truncated
+    
+    # Store in database after the response has been sent
     for analysis in analyses:
-        if isinstance(analysis.get('created_at'), str):
-            analysis['created_at'] = datetime.fromisoformat(analysis['created_at'])
+        recent_analyses[analysis.id] = analysis
+    background_tasks.add_task(persist_analyses, [analysis.dict() for analysis in analyses])
     
-    return [DocumentAnalysis(**analysis) for analysis in analyses]
+    return analyses
+
+@api_router.get("/analyses", response_model=AnalysisPage)
+async def get_analyses(skip: int = Query(0, ge=0), limit: int = Query(20, ge=1)):
+    """Get a page of document analyses, newest first"""
+    limit = min(limit, MAX_ANALYSES_PAGE_SIZE)
+    cursor = db.document_analyses.find({}, ANALYSIS_SUMMARY_PROJECTION).sort("created_at", -1)
+    analyses = await cursor.skip(skip).limit(limit).batch_size(limit).to_list(limit)
+    
+    return AnalysisPage(
+        items=[DocumentAnalysisSummary(**analysis) for analysis in analyses],
+        next_skip=skip + limit if len(analyses) == limit else None
+    )
 
 @api_router.get("/analysis/{analysis_id}", response_model=DocumentAnalysis)
 async def get_analysis(analysis_id: str):
     """Get specific document analysis"""
+    if analysis_id in recent_analyses:
+        return recent_analyses[analysis_id]
+    
     analysis = await db.document_analyses.find_one({"id": analysis_id})
     
     if not analysis:
         raise HTTPException(status_code=404, detail="Analysis not found")
     
-    if isinstance(analysis.get('created_at'), str):
-        analysis['created_at'] = datetime.fromisoformat(analysis['created_at'])
-    
+    analysis['full_document_text'] = decompress_document_text(analysis.get('full_document_text'))
     return DocumentAnalysis(**analysis)
 
 @api_router.delete("/analysis/{analysis_id}")
 async def delete_analysis(analysis_id: str):
     """Delete document analysis"""
+    was_recent = recent_analyses.pop(analysis_id, None) is not None
+    if was_recent:
+        # The background write may not have landed yet
+        deleted_analysis_ids[analysis_id] = True
     result = await db.document_analyses.delete_one({"id": analysis_id})
     
-    if result.deleted_count == 0:
+    if result.deleted_count == 0 and not was_recent:
         raise HTTPException(status_code=404, detail="Analysis not found")
     
     return {"message": "Analysis deleted successfully"}
@@ -253,18 +712,65 @@ app.include_router(api_router)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+    allow_origins=CORS_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+async def reconcile_analysis_created_at_index():
+    """Bring the created_at index, which backs listing sorts, in line with ANALYSIS_RETENTION_DAYS"""
+    indexes = await db.document_analyses.index_information()
+    for name, info in indexes.items():
+        # Superseded by the ascending index, which also serves descending sorts
+        if dict(info["key"]) == {"created_at": -1}:
+            await db.document_analyses.drop_index(name)
+    
+    retention_seconds = ANALYSIS_RETENTION_DAYS * 24 * 60 * 60
+    existing = next(
+        ((name, info) for name, info in indexes.items() if dict(info["key"]) == {"created_at": 1}), None
+    )
+    if existing is not None:
+        name, info = existing
+        current_seconds = info.get("expireAfterSeconds")
+        if current_seconds == (retention_seconds or None):
+            return
+        if current_seconds is not None and retention_seconds:
+            await db.command(
+                "collMod", "document_analyses",
+                index={"keyPattern": {"created_at": 1}, "expireAfterSeconds": retention_seconds}
+            )
+            return
+        await db.document_analyses.drop_index(name)
+    
+    if retention_seconds:
+        await db.document_analyses.create_index("created_at", expireAfterSeconds=retention_seconds)
+    else:
+        await db.document_analyses.create_index("created_at")
+
+async def sync_analysis_created_at_index():
+    """Reconcile the created_at index, tolerating other workers doing the same at startup"""
+    for attempt in range(1, INDEX_SYNC_ATTEMPTS + 1):
+        try:
+            await reconcile_analysis_created_at_index()
+            return
+        except OperationFailure as e:
+            # Workers started together race to drop and recreate the index; the next
+            # attempt re-reads whatever state the winner left behind
+            logger.warning(f"Syncing the created_at index failed (attempt {attempt}): {str(e)}")
+    logger.error("Could not sync the created_at index; analysis retention is unchanged")
+
+@app.on_event("startup")
+async def create_indexes():
+    # Index maintenance must not keep the API from starting when MongoDB is unavailable
+    try:
+        await sync_analysis_created_at_index()
+        # Expire cached LLM responses after a week
+        await db.llm_response_cache.create_index("created_at", expireAfterSeconds=LLM_CACHE_TTL_SECONDS)
+        await db.analysis_embeddings.create_index("created_at", expireAfterSeconds=LLM_CACHE_TTL_SECONDS)
+    except PyMongoError as e:
+        logger.error(f"Failed to create indexes at startup: {str(e)}")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+    pdf_pool.shutdown(wait=False, cancel_futures=True)
\ No newline at end of file
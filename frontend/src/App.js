@@ -200,7 +200,7 @@ const DocumentUpload = ({ onAnalysisComplete }) => {
 };
 
 const DocumentWithHighlights = ({ analysis }) => {
-  const { full_document_text, clauses } = analysis;
+  const { full_document_text, clauses, text_truncated } = analysis;
   
   // Create highlighting function
   const getHighlightedDocument = () => {
@@ -316,6 +316,11 @@ const DocumentWithHighlights = ({ analysis }) => {
       <div className="text-sm text-slate-700 leading-relaxed whitespace-pre-wrap font-mono max-h-96 overflow-y-auto">
         {getHighlightedDocument()}
       </div>
+      {text_truncated && (
+        <div className="mt-4 text-xs text-amber-700">
+          ⚠️ Only the beginning of this document was extracted and analyzed; later pages are not shown
+        </div>
+      )}
       <div className="mt-4 text-xs text-slate-500">
         💡 Hover over highlighted sections to see risk explanations
       </div>
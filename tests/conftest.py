@@ -0,0 +1,102 @@
+import os
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+# The backend is run from its own directory, so its modules import each other by name
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+
+
+class UserMessage:
+    def __init__(self, text):
+        self.text = text
+
+
+class LlmChat:
+    """Stand-in for the private LLM SDK; tests replace get_llm_chat where a response is needed"""
+
+    def __init__(self, api_key, session_id, system_message):
+        self.system_message = system_message
+
+    def with_model(self, provider, model):
+        return self
+
+    async def send_message(self, message):
+        raise RuntimeError("Tests must not call the real LLM")
+
+
+# The emergentintegrations SDK comes from a private index, so tests always run against this stub
+for name in ("emergentintegrations", "emergentintegrations.llm", "emergentintegrations.llm.chat"):
+    sys.modules[name] = types.ModuleType(name)
+sys.modules["emergentintegrations.llm.chat"].LlmChat = LlmChat
+sys.modules["emergentintegrations.llm.chat"].UserMessage = UserMessage
+
+
+class FakeCollection:
+    """In-memory stand-in for the few Motor collection methods the server uses"""
+
+    def __init__(self, name):
+        self.name = name
+        self.documents = []
+        self.indexes = {"_id_": {"key": [("_id", 1)]}}
+        self.calls = []
+
+    async def find_one(self, filter):
+        self.calls.append(("find_one", filter))
+        return next((d for d in self.documents if all(d.get(k) == v for k, v in filter.items())), None)
+
+    async def insert_many(self, documents, ordered=True):
+        self.calls.append(("insert_many", [d["id"] for d in documents]))
+        self.documents.extend(documents)
+
+    async def delete_many(self, filter):
+        ids = filter["id"]["$in"]
+        self.calls.append(("delete_many", ids))
+        self.documents = [d for d in self.documents if d["id"] not in ids]
+
+    async def delete_one(self, filter):
+        self.calls.append(("delete_one", filter))
+        match = await self.find_one(filter)
+        if match is not None:
+            self.documents.remove(match)
+        return types.SimpleNamespace(deleted_count=int(match is not None))
+
+    async def index_information(self):
+        self.calls.append(("index_information",))
+        return {name: dict(info) for name, info in self.indexes.items()}
+
+    async def drop_index(self, name):
+        self.calls.append(("drop_index", name))
+        del self.indexes[name]
+
+    async def create_index(self, key, **kwargs):
+        self.calls.append(("create_index", key, kwargs))
+        name = f"{key}_1"
+        self.indexes[name] = {"key": [(key, 1)], **kwargs}
+        return name
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+        self.commands = []
+
+    def __getattr__(self, name):
+        return self.collections.setdefault(name, FakeCollection(name))
+
+    async def command(self, name, *args, **kwargs):
+        self.commands.append((name, *args, kwargs))
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    import server
+
+    database = FakeDatabase()
+    monkeypatch.setattr(server, "db", database)
+    return database
@@ -0,0 +1,148 @@
+import asyncio
+import io
+
+import orjson
+import pytest
+from fastapi import HTTPException, UploadFile
+
+import server
+
+LEGAL_TEXT = (
+    "This Agreement is made between the parties. The Licensee shall pay all fees, and the "
+    "Licensor's liability is limited. Either party may terminate this Agreement on notice. "
+) * 3
+
+
+def clause(risk_level=None, **overrides):
+    data = {"clause_text": "Auto-renews yearly", "risk_score": 7, "explanation": "Hard to cancel"}
+    if risk_level is not None:
+        data["risk_level"] = risk_level
+    data.update(overrides)
+    return data
+
+
+@pytest.mark.parametrize("risk_level, expected", [
+    ("High", server.RiskLevel.HIGH),
+    ("medium", server.RiskLevel.MEDIUM),
+    (None, server.RiskLevel.LOW),
+    ("severe", server.RiskLevel.LOW),
+])
+def test_build_document_analysis_normalizes_risk_levels(risk_level, expected):
+    analysis = server.build_document_analysis({"clauses": [clause(risk_level)]}, LEGAL_TEXT, "a.txt")
+    assert analysis.clauses[0].risk_level == expected
+
+
+def test_build_document_analysis_averages_risk_scores():
+    ai_analysis = {"clauses": [clause("low", risk_score=2), clause("high", risk_score=9)], "summary": "s"}
+    analysis = server.build_document_analysis(ai_analysis, LEGAL_TEXT, "a.txt")
+    assert analysis.overall_risk_score == 5.5
+    assert analysis.summary == "s"
+    assert server.build_document_analysis({}, LEGAL_TEXT, "a.txt").overall_risk_score == 0
+
+
+def test_looks_like_legal_document():
+    assert server.looks_like_legal_document(LEGAL_TEXT)
+    assert not server.looks_like_legal_document("Preheat the oven and mix the flour with sugar. " * 10)
+
+
+def test_short_upload_is_rejected():
+    upload = UploadFile(io.BytesIO(b"This agreement shall bind the parties."), filename="short.txt")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(server.extract_upload_text(upload))
+    assert error.value.status_code == 400
+    assert error.value.detail == "Document too short to analyze"
+
+
+def test_long_upload_is_extracted():
+    upload = UploadFile(io.BytesIO(LEGAL_TEXT.encode("utf-8")), filename="contract.txt")
+    assert asyncio.run(server.extract_upload_text(upload)) == (LEGAL_TEXT, False)
+
+
+def test_document_text_compression_round_trip():
+    stored = server.compress_document_text(LEGAL_TEXT)
+    assert set(stored) == {"zstd"}
+    assert len(stored["zstd"]) < len(LEGAL_TEXT)
+    assert server.decompress_document_text(stored) == LEGAL_TEXT
+
+
+@pytest.mark.parametrize("legacy", ["plain stored text", None])
+def test_legacy_document_text_is_returned_unchanged(legacy):
+    assert server.decompress_document_text(legacy) == legacy
+
+
+@pytest.mark.parametrize("response", [
+    '{"summary": "ok"}',
+    '  ```json\n{"summary": "ok"}\n```  ',
+    '```\n{"summary": "ok"}```',
+])
+def test_parse_ai_response_strips_fences(response):
+    assert server.parse_ai_response(response) == {"summary": "ok"}
+
+
+def test_parse_ai_response_rejects_invalid_json():
+    with pytest.raises(orjson.JSONDecodeError):
+        server.parse_ai_response("```json\nnot json\n```")
+
+
+class StubChat:
+    def __init__(self, prompts):
+        self.prompts = prompts
+
+    async def send_message(self, message):
+        self.prompts.append(message.text)
+        if message.text.startswith(server.BATCH_PROMPT_PREFIX):
+            # Out of order, and without a result for document 1
+            return orjson.dumps({"results": [
+                {"doc_index": 2, "summary": "doc 2", "clauses": [clause("high")]},
+                {"doc_index": "0", "summary": "doc 0", "clauses": []},
+            ]}).decode()
+        return '```json\n{"summary": "single", "clauses": []}\n```'
+
+
+def test_batch_results_fan_out_by_doc_index(monkeypatch):
+    prompts = []
+
+    async def no_cached_analysis(text, filename):
+        return None
+
+    async def skip_caching(text, filename, ai_analysis):
+        pass
+
+    monkeypatch.setattr(server, "get_llm_chat", lambda: StubChat(prompts))
+    monkeypatch.setattr(server, "lookup_cached_analysis", no_cached_analysis)
+    monkeypatch.setattr(server, "cache_ai_analysis", skip_caching)
+
+    filenames = ["a.txt", "b.txt", "c.txt"]
+    analyses = asyncio.run(server.analyze_documents_with_ai([LEGAL_TEXT] * 3, filenames))
+
+    assert [analysis.filename for analysis in analyses] == filenames
+    assert [analysis.summary for analysis in analyses] == ["doc 0", "single", "doc 2"]
+    assert analyses[2].clauses[0].risk_level == server.RiskLevel.HIGH
+    # One bundled call, then one single-document call for the missing result
+    assert len(prompts) == 2
+    assert prompts[1].startswith("DOCUMENT: b.txt\n")
+
+
+class SlowChat:
+    def __init__(self, in_flight, peaks):
+        self.in_flight = in_flight
+        self.peaks = peaks
+
+    async def send_message(self, message):
+        self.in_flight.append(message.text)
+        self.peaks.append(len(self.in_flight))
+        await asyncio.sleep(0.01)
+        self.in_flight.remove(message.text)
+        return message.text
+
+
+def test_concurrent_llm_calls_are_bounded(monkeypatch):
+    in_flight, peaks = [], []
+    monkeypatch.setattr(server, "llm_semaphore", asyncio.Semaphore(2))
+    monkeypatch.setattr(server, "get_llm_chat", lambda: SlowChat(in_flight, peaks))
+
+    async def send_all():
+        return await asyncio.gather(*[server.send_llm_message(f"prompt {i}") for i in range(5)])
+
+    assert asyncio.run(send_all()) == [f"prompt {i}" for i in range(5)]
+    assert max(peaks) == 2
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+from cachetools import TTLCache
+
+import server
+
+TEXT = "This Agreement binds the parties. The Licensee shall indemnify the Licensor. " * 4
+FILENAME = "contract.txt"
+AI_ANALYSIS = {"summary": "cached", "clauses": [], "document_type": "contract"}
+
+
+@pytest.fixture(autouse=True)
+def empty_l1_cache(monkeypatch):
+    monkeypatch.setattr(server, "ai_analysis_cache", TTLCache(maxsize=16, ttl=600))
+    monkeypatch.setattr(server, "VECTOR_SEARCH_INDEX", None)
+
+
+@pytest.fixture
+def vector_searches(monkeypatch):
+    searches = []
+
+    async def find_similar(embedding, cache_scope):
+        searches.append(cache_scope)
+        return {**AI_ANALYSIS, "summary": "similar"}, 0.98123
+
+    monkeypatch.setattr(server, "find_similar_ai_analysis", find_similar)
+    return searches
+
+
+def lookup():
+    return asyncio.run(server.lookup_cached_analysis(TEXT, FILENAME))
+
+
+def store_in_mongo(fake_db):
+    cache_key = server.get_analysis_cache_key(TEXT, FILENAME)
+    fake_db.llm_response_cache.documents.append({"_id": cache_key, "analysis_json": AI_ANALYSIS})
+    return cache_key
+
+
+def test_l1_hit_skips_mongo(fake_db, vector_searches, monkeypatch):
+    monkeypatch.setattr(server, "VECTOR_SEARCH_INDEX", "analysis_embeddings_index")
+    server.ai_analysis_cache[server.get_analysis_cache_key(TEXT, FILENAME)] = AI_ANALYSIS
+
+    analysis = lookup()
+
+    assert analysis.summary == "cached"
+    assert fake_db.llm_response_cache.calls == []
+    assert vector_searches == []
+
+
+def test_mongo_hit_is_promoted_to_l1(fake_db, vector_searches, monkeypatch):
+    monkeypatch.setattr(server, "VECTOR_SEARCH_INDEX", "analysis_embeddings_index")
+    cache_key = store_in_mongo(fake_db)
+
+    analysis = lookup()
+
+    assert analysis.summary == "cached"
+    assert analysis.similar_document_score is None
+    assert vector_searches == []
+    assert server.ai_analysis_cache[cache_key] == AI_ANALYSIS
+
+
+def test_vector_search_is_skipped_without_an_index(fake_db, vector_searches):
+    assert lookup() is None
+    assert fake_db.llm_response_cache.calls == [("find_one", {"_id": server.get_analysis_cache_key(TEXT, FILENAME)})]
+    assert vector_searches == []
+
+
+def test_vector_search_runs_last_and_flags_the_result(fake_db, vector_searches, monkeypatch):
+    monkeypatch.setattr(server, "VECTOR_SEARCH_INDEX", "analysis_embeddings_index")
+
+    analysis = lookup()
+
+    assert len(fake_db.llm_response_cache.calls) == 1
+    assert vector_searches == [server.get_cache_scope(FILENAME)]
+    assert analysis.summary == "similar"
+    assert analysis.similar_document_score == 0.9812
+    # A borrowed analysis must not become an exact-match entry
+    assert len(server.ai_analysis_cache) == 0
+
+
+class FakeCursor:
+    def __init__(self, results):
+        self.results = results
+
+    async def to_list(self, length):
+        return self.results[:length]
+
+
+@pytest.mark.parametrize("score, expected", [(0.995, 0.99), (0.98, None)])
+def test_vector_search_score_is_rescaled_before_the_threshold(fake_db, monkeypatch, score, expected):
+    cache_key = store_in_mongo(fake_db)
+    monkeypatch.setattr(
+        fake_db.analysis_embeddings, "aggregate", lambda pipeline: FakeCursor([{"_id": cache_key, "score": score}]),
+        raising=False
+    )
+
+    match = asyncio.run(server.find_similar_ai_analysis([0.0], server.get_cache_scope(FILENAME)))
+
+    if expected is None:
+        assert match is None
+    else:
+        assert match == (AI_ANALYSIS, pytest.approx(expected))
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
+
+import server
+
+DAY_SECONDS = 24 * 60 * 60
+
+
+def set_indexes(collection, **indexes):
+    collection.indexes = {"_id_": {"key": [("_id", 1)]}, **indexes}
+
+
+def sync(monkeypatch, retention_days):
+    monkeypatch.setattr(server, "ANALYSIS_RETENTION_DAYS", retention_days)
+    asyncio.run(server.sync_analysis_created_at_index())
+
+
+def changes(collection):
+    return [call for call in collection.calls if call[0] != "index_information"]
+
+
+@pytest.mark.parametrize("retention_days, options", [(0, {}), (30, {"expireAfterSeconds": 30 * DAY_SECONDS})])
+def test_creates_missing_index(fake_db, monkeypatch, retention_days, options):
+    sync(monkeypatch, retention_days)
+
+    assert changes(fake_db.document_analyses) == [("create_index", "created_at", options)]
+
+
+def test_drops_superseded_descending_index(fake_db, monkeypatch):
+    collection = fake_db.document_analyses
+    set_indexes(collection, created_at_1={"key": [("created_at", 1)]}, created_at_neg1={"key": [("created_at", -1)]})
+
+    sync(monkeypatch, 0)
+
+    assert changes(collection) == [("drop_index", "created_at_neg1")]
+
+
+@pytest.mark.parametrize("retention_days, current", [(0, None), (30, 30 * DAY_SECONDS)])
+def test_leaves_matching_index_alone(fake_db, monkeypatch, retention_days, current):
+    collection = fake_db.document_analyses
+    info = {"key": [("created_at", 1)]}
+    if current is not None:
+        info["expireAfterSeconds"] = current
+    set_indexes(collection, created_at_1=info)
+
+    sync(monkeypatch, retention_days)
+
+    assert changes(collection) == []
+    assert fake_db.commands == []
+
+
+def test_changes_ttl_in_place(fake_db, monkeypatch):
+    collection = fake_db.document_analyses
+    set_indexes(collection, created_at_1={"key": [("created_at", 1)], "expireAfterSeconds": 30 * DAY_SECONDS})
+
+    sync(monkeypatch, 7)
+
+    assert changes(collection) == []
+    assert fake_db.commands == [(
+        "collMod", "document_analyses",
+        {"index": {"keyPattern": {"created_at": 1}, "expireAfterSeconds": 7 * DAY_SECONDS}}
+    )]
+
+
+def test_disabling_retention_recreates_plain_index(fake_db, monkeypatch):
+    collection = fake_db.document_analyses
+    set_indexes(collection, created_at_1={"key": [("created_at", 1)], "expireAfterSeconds": 30 * DAY_SECONDS})
+
+    sync(monkeypatch, 0)
+
+    assert changes(collection) == [("drop_index", "created_at_1"), ("create_index", "created_at", {})]
+
+
+def test_enabling_retention_recreates_ttl_index(fake_db, monkeypatch):
+    collection = fake_db.document_analyses
+    set_indexes(collection, created_at_1={"key": [("created_at", 1)]})
+
+    sync(monkeypatch, 30)
+
+    assert changes(collection) == [
+        ("drop_index", "created_at_1"),
+        ("create_index", "created_at", {"expireAfterSeconds": 30 * DAY_SECONDS}),
+    ]
+
+
+def test_rereads_indexes_after_losing_a_race(fake_db, monkeypatch):
+    collection = fake_db.document_analyses
+    set_indexes(collection, created_at_1={"key": [("created_at", 1)], "expireAfterSeconds": 30 * DAY_SECONDS})
+
+    async def dropped_by_another_worker(name):
+        collection.calls.append(("drop_index", name))
+        # The other worker finished the whole change first
+        set_indexes(collection, created_at_1={"key": [("created_at", 1)]})
+        raise OperationFailure("index not found with name [created_at_1]", code=27)
+
+    monkeypatch.setattr(collection, "drop_index", dropped_by_another_worker)
+
+    sync(monkeypatch, 0)
+
+    assert changes(collection) == [("drop_index", "created_at_1")]
+    assert collection.calls.count(("index_information",)) == 2
+
+
+def test_gives_up_after_repeated_failures(fake_db, monkeypatch):
+    async def always_fails(*args, **kwargs):
+        raise OperationFailure("Index with name: created_at_1 already exists with different options", code=85)
+
+    monkeypatch.setattr(fake_db.document_analyses, "create_index", always_fails)
+
+    sync(monkeypatch, 30)
+
+    assert fake_db.document_analyses.calls.count(("index_information",)) == server.INDEX_SYNC_ATTEMPTS
+
+
+def test_startup_survives_unreachable_mongo(fake_db, monkeypatch):
+    async def unreachable():
+        raise ServerSelectionTimeoutError("localhost:27017: connection refused")
+
+    monkeypatch.setattr(fake_db.document_analyses, "index_information", unreachable)
+
+    asyncio.run(server.create_indexes())
+
+    assert fake_db.llm_response_cache.calls == []
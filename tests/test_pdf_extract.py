@@ -0,0 +1,120 @@
+import asyncio
+import io
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+pytest.importorskip("pypdfium2")
+
+import server
+from pdf_extract import extract_text_from_pdf
+
+
+def build_pdf(page_texts):
+    """Build a minimal PDF with one line of Helvetica text per page"""
+    page_count = len(page_texts)
+    font_id = 3 + 2 * page_count
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (3 + 2 * i) for i in range(page_count))
+        + b"] /Count %d >>" % page_count,
+    ]
+    for i, text in enumerate(page_texts):
+        stream = b"BT /F1 8 Tf 10 700 Td (" + text.encode("latin-1") + b") Tj ET"
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (4 + 2 * i, font_id)
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(pdf)
+
+
+PAGES = [f"PAGE{i:02d} " + "lorem ipsum " * 8 for i in range(30)]
+
+
+def upload(pdf_bytes):
+    return UploadFile(io.BytesIO(pdf_bytes), filename="contract.pdf")
+
+
+def test_extracts_every_page_within_budget():
+    text, truncated = extract_text_from_pdf(build_pdf(PAGES[:3]), 100000)
+    assert "PAGE00" in text and "PAGE02" in text
+    assert not truncated
+
+
+def test_stops_at_max_extract_chars():
+    text, truncated = extract_text_from_pdf(build_pdf(PAGES), 300)
+    assert len(text) == 300
+    assert "PAGE00" in text
+    assert "PAGE29" not in text
+    assert truncated
+
+
+def test_cutting_the_last_page_short_counts_as_truncated():
+    full_text, _ = extract_text_from_pdf(build_pdf(PAGES[:1]), 100000)
+
+    assert extract_text_from_pdf(build_pdf(PAGES[:1]), len(full_text)) == (full_text, False)
+    assert extract_text_from_pdf(build_pdf(PAGES[:1]), len(full_text) - 1)[1]
+
+
+def test_truncated_pdf_upload_is_flagged(monkeypatch):
+    monkeypatch.setattr(server, "pdf_pool", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(server, "MAX_EXTRACT_CHARS", 300)
+
+    text, truncated = asyncio.run(server.extract_upload_text(upload(build_pdf(PAGES))))
+
+    assert len(text) == 300
+    assert truncated
+
+
+class CrashingPool(Executor):
+    """A process pool whose worker died: every submission fails with BrokenProcessPool"""
+
+    def __init__(self):
+        self.submissions = 0
+
+    def submit(self, fn, *args, **kwargs):
+        self.submissions += 1
+        raise BrokenProcessPool("A child process terminated abruptly")
+
+
+def test_pdf_is_resubmitted_to_a_fresh_pool_after_a_crash(monkeypatch):
+    crashed = CrashingPool()
+    monkeypatch.setattr(server, "pdf_pool", crashed)
+    monkeypatch.setattr(server, "create_pdf_pool", lambda: ThreadPoolExecutor(max_workers=1))
+
+    text, truncated = asyncio.run(server.read_pdf_upload(upload(build_pdf(PAGES[:2]))))
+
+    assert "PAGE01" in text and not truncated
+    assert crashed.submissions == 1
+    assert server.pdf_pool is not crashed
+
+
+def test_pdf_that_keeps_crashing_is_rejected(monkeypatch):
+    pools = []
+
+    def create_pdf_pool():
+        pools.append(CrashingPool())
+        return pools[-1]
+
+    monkeypatch.setattr(server, "pdf_pool", create_pdf_pool())
+    monkeypatch.setattr(server, "create_pdf_pool", create_pdf_pool)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(server.read_pdf_upload(upload(build_pdf(PAGES[:2]))))
+
+    assert error.value.status_code == 400
+    assert sum(pool.submissions for pool in pools) == server.PDF_PARSE_ATTEMPTS
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+
+import pytest
+from cachetools import TTLCache
+from pymongo.errors import BulkWriteError
+
+import server
+
+
+@pytest.fixture(autouse=True)
+def fresh_tombstones(monkeypatch):
+    monkeypatch.setattr(server, "deleted_analysis_ids", TTLCache(maxsize=16, ttl=600))
+    monkeypatch.setattr(server, "PERSIST_BACKOFF_SECONDS", 0)
+
+
+def analysis_dicts(*ids):
+    return [{"id": analysis_id, "full_document_text": f"text of {analysis_id}"} for analysis_id in ids]
+
+
+def test_compresses_text_and_writes_in_one_call(fake_db):
+    asyncio.run(server.persist_analyses(analysis_dicts("a", "b")))
+
+    collection = fake_db.document_analyses
+    assert collection.calls == [("insert_many", ["a", "b"])]
+    assert server.decompress_document_text(collection.documents[0]["full_document_text"]) == "text of a"
+
+
+def test_skips_analyses_deleted_before_the_write(fake_db):
+    server.deleted_analysis_ids["a"] = True
+
+    asyncio.run(server.persist_analyses(analysis_dicts("a", "b")))
+
+    assert fake_db.document_analyses.calls == [("insert_many", ["b"])]
+
+
+def test_skips_the_write_when_every_analysis_was_deleted(fake_db):
+    server.deleted_analysis_ids["a"] = True
+
+    asyncio.run(server.persist_analyses(analysis_dicts("a")))
+
+    assert fake_db.document_analyses.calls == []
+
+
+def test_removes_analyses_deleted_while_the_write_was_in_flight(fake_db, monkeypatch):
+    collection = fake_db.document_analyses
+    insert_many = collection.insert_many
+
+    async def insert_then_delete(documents, ordered=True):
+        await insert_many(documents, ordered)
+        server.deleted_analysis_ids["a"] = True
+
+    monkeypatch.setattr(collection, "insert_many", insert_then_delete)
+
+    asyncio.run(server.persist_analyses(analysis_dicts("a", "b")))
+
+    assert collection.calls[-1] == ("delete_many", ["a"])
+    assert [d["id"] for d in collection.documents] == ["b"]
+
+
+def test_retry_drops_analyses_deleted_between_attempts(fake_db, monkeypatch):
+    collection = fake_db.document_analyses
+    insert_many = collection.insert_many
+    attempts = []
+
+    async def fail_once(documents, ordered=True):
+        attempts.append([d["id"] for d in documents])
+        if len(attempts) == 1:
+            server.deleted_analysis_ids["a"] = True
+            raise ConnectionError("primary stepped down")
+        await insert_many(documents, ordered)
+
+    monkeypatch.setattr(collection, "insert_many", fail_once)
+
+    asyncio.run(server.persist_analyses(analysis_dicts("a", "b")))
+
+    assert attempts == [["a", "b"], ["b"]]
+    assert [d["id"] for d in collection.documents] == ["b"]
+
+
+def test_duplicate_key_retry_still_removes_deleted_analyses(fake_db, monkeypatch):
+    collection = fake_db.document_analyses
+    insert_many = collection.insert_many
+
+    async def already_stored(documents, ordered=True):
+        # An earlier attempt landed despite reporting an error
+        await insert_many(documents, ordered)
+        server.deleted_analysis_ids["a"] = True
+        raise BulkWriteError({"writeErrors": [{"code": 11000}, {"code": 11000}]})
+
+    monkeypatch.setattr(collection, "insert_many", already_stored)
+
+    asyncio.run(server.persist_analyses(analysis_dicts("a", "b")))
+
+    assert collection.calls[-1] == ("delete_many", ["a"])
+    assert [d["id"] for d in collection.documents] == ["b"]
+
+
+def test_deleting_a_recent_analysis_tombstones_it(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "recent_analyses", TTLCache(maxsize=16, ttl=60))
+    server.recent_analyses["a"] = object()
+
+    assert asyncio.run(server.delete_analysis("a")) == {"message": "Analysis deleted successfully"}
+    assert "a" in server.deleted_analysis_ids
+
+    asyncio.run(server.persist_analyses(analysis_dicts("a")))
+    assert fake_db.document_analyses.documents == []
+
+
+@pytest.mark.parametrize("text_length, off_loop", [(100, False), (server.COMPRESS_OFF_LOOP_CHARS + 1, True)])
+def test_large_texts_are_compressed_off_the_event_loop(fake_db, monkeypatch, text_length, off_loop):
+    compress_document_text = server.compress_document_text
+    threads = []
+
+    def record_thread(text):
+        threads.append(threading.current_thread())
+        return compress_document_text(text)
+
+    monkeypatch.setattr(server, "compress_document_text", record_thread)
+
+    asyncio.run(server.persist_analyses([{"id": "a", "full_document_text": "x" * text_length}]))
+
+    assert (threads[0] is not threading.main_thread()) == off_loop
+    stored = fake_db.document_analyses.documents[0]["full_document_text"]
+    assert server.decompress_document_text(stored) == "x" * text_length
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import server
+
+PREAMBLE = (
+    "MASTER SERVICES AGREEMENT\n\nThis Master Services Agreement is entered into by and between "
+    "the parties identified below. The parties hereby agree as follows.\n\n"
+    + "".join(
+        f"{i}. GENERAL TERMS. Each party shall comply with all applicable laws and regulations "
+        f"in performing its obligations under section {i} of this Agreement. "
+        for i in range(1, 14)
+    )
+)
+
+TERMINATION_CONTRACT = PREAMBLE + "".join(
+    f"\n{i}. TERMINATION. Either party may terminate this Agreement for convenience on thirty days "
+    f"written notice, and the Customer shall receive a pro rata refund of prepaid fees for clause {i}. "
+    for i in range(14, 24)
+)
+
+INDEMNITY_CONTRACT = PREAMBLE + "".join(
+    f"\n{i}. INDEMNITY. Customer shall indemnify, defend and hold harmless the Provider against all "
+    f"claims, and Provider's total liability is limited to one hundred dollars under clause {i}. "
+    for i in range(14, 24)
+)
+
+
+def similarity(first, second):
+    return float(np.dot(server.embed_document_text(first), server.embed_document_text(second)))
+
+
+def test_same_template_contracts_differing_after_2000_chars_do_not_match():
+    assert len(PREAMBLE) > 2000
+    assert TERMINATION_CONTRACT[:2000] == INDEMNITY_CONTRACT[:2000]
+    assert similarity(TERMINATION_CONTRACT, INDEMNITY_CONTRACT) < server.SEMANTIC_CACHE_THRESHOLD
+
+
+def test_reupload_with_new_header_and_whitespace_matches():
+    reupload = "CONFIDENTIAL DRAFT v2\n\n" + TERMINATION_CONTRACT.replace(". ", ".  \n")
+    assert similarity(TERMINATION_CONTRACT, reupload) >= server.SEMANTIC_CACHE_THRESHOLD
+
+
+def test_embedding_is_unit_length():
+    assert np.linalg.norm(server.embed_document_text(TERMINATION_CONTRACT)) == pytest.approx(1.0, abs=1e-5)
+    assert not any(server.embed_document_text("ab"))